@@ -2,41 +2,198 @@
 open/save the draw.io diagram drawing format
 """
 import typing
+import io
+import os
 import base64
 import zlib
-from urllib.parse import unquote,quote
-import lxml.etree
+from urllib.parse import unquote_to_bytes,quote_from_bytes
+import copy
+import functools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from lxml import etree
+    HAS_LXML=True
+except ImportError:
+    import xml.etree.ElementTree as etree # type: ignore
+    HAS_LXML=False
+
+
+# base64 characters to decode at a time (a multiple of 4)
+DECODE_CHUNK_SIZE=64*1024
+
+# roughly how many times bigger a diagram block gets when inflated
+INFLATE_SIZE_ESTIMATE=10
+
+# cap on the up-front allocation for an inflated block
+INFLATE_PREALLOCATE_LIMIT=4*1024*1024
+
+# blocks smaller than this are not worth loading numba to unquote
+COMPILED_UNQUOTE_THRESHOLD=1024*1024
+
+
+def _pctDecodeInto(buf,out,nibbles)->int:
+    """
+    expand the %XX escapes in a uint8 array into another one
+    (invalid escapes are left alone, same as unquote_to_bytes)
+
+    this is compiled with numba, see _compiledUnquote()
+
+    :param nibbles: value of each byte as a hex digit, or -1
+    :return: how much of out was used
+    """
+    n=len(buf)
+    i=0
+    j=0
+    while i<n:
+        c=buf[i]
+        if c==37 and i+2<n: # '%'
+            hi=nibbles[buf[i+1]]
+            lo=nibbles[buf[i+2]]
+            if hi>=0 and lo>=0:
+                out[j]=hi*16+lo
+                i+=3
+                j+=1
+                continue
+        out[j]=c
+        i+=1
+        j+=1
+    return j
+
+
+@functools.lru_cache(maxsize=None)
+def _compiledUnquote()->typing.Optional[typing.Callable[[typing.Any],bytes]]:
+    """
+    get an unquote function that runs compiled code
+
+    numba is imported (and the kernel loaded from its cache, or compiled)
+    the first time this is called, since that takes a while
+
+    returns None if numba is not installed
+    """
+    try:
+        import numpy # pylint: disable=import-outside-toplevel
+        from numba import njit # type: ignore # noqa: E501 # pylint: disable=import-outside-toplevel,line-too-long
+    except ImportError:
+        return None
+    nibbles=numpy.full(256,-1,dtype=numpy.int16)
+    for i,c in enumerate(b'0123456789abcdef'):
+        nibbles[c]=i
+    for i,c in enumerate(b'ABCDEF'):
+        nibbles[c]=i+10
+    # nogil so that pages can be unquoted side by side
+    kernel=njit(cache=True,nogil=True)(_pctDecodeInto)
+
+    def unquote(b)->bytes:
+        buf=numpy.frombuffer(b,dtype=numpy.uint8)
+        out=numpy.empty_like(buf)
+        return out[:kernel(buf,out,nibbles)].tobytes()
+    return unquote
+
+
+def _unquoteBytes(b:typing.Union[bytes,bytearray]
+    )->typing.Union[bytes,bytearray]:
+    """
+    expand the %XX escapes in some bytes,
+    with compiled code if it is big enough to be worth it
+    """
+    if b'%' not in b:
+        return b
+    if len(b)>=COMPILED_UNQUOTE_THRESHOLD:
+        unquote=_compiledUnquote()
+        if unquote is not None:
+            return unquote(b)
+    # unquote_to_bytes won't take a bytearray
+    return unquote_to_bytes(bytes(b))
+
+
+def _xmlFromBytes(data:bytes)->etree.Element:
+    """
+    parse an xml document with whichever etree we have
+    """
+    if HAS_LXML:
+        return etree.fromstring(data,
+            parser=etree.XMLParser(huge_tree=True))
+    return etree.fromstring(data)
+
+
+def _xmlToString(xml:etree.Element)->str:
+    """
+    pretty-print an xml tree with whichever etree we have
+    """
+    if HAS_LXML:
+        return etree.tostring(xml,pretty_print=True).decode('utf-8') # noqa: E501 # pylint: disable=line-too-long,unexpected-keyword-arg
+    # stdlib indents in place, so don't touch the original
+    xml=copy.deepcopy(xml)
+    etree.indent(xml)
+    return etree.tostring(xml,encoding='unicode')
+
+
+def _iterparseDiagrams(data:bytes
+    )->typing.Tuple[typing.Any,typing.Iterable[etree.Element]]:
+    """
+    stream the <diagram> elements out of an xml document as each one
+    is completely parsed
+
+    returns (parser context,diagram elements), and once the elements
+    are exhausted, context.root is the whole document
+    """
+    if HAS_LXML:
+        context=etree.iterparse(io.BytesIO(data), # noqa: E501 # pylint: disable=line-too-long,unexpected-keyword-arg
+            events=('end',),tag='diagram',huge_tree=True)
+        return context,(elem for _,elem in context)
+    context=etree.iterparse(io.BytesIO(data),events=('end',))
+    return context,(elem for _,elem in context if elem.tag=='diagram')
 
 
 class MxItem:
     """
     base class for mx items
     """
+
+    # there can be a great many of these, so keep them lean
+    __slots__=('_fileChildren','_parent','_children','_root','_fileRoot',
+        'fileParent','_xmlTag','_tag','_id','_parentId','_value')
+
     def __init__(self,
         fileParent:typing.Optional["MxItem"],
-        xmlTag:lxml.etree.Element):
-        """ """
+        xmlTag:etree.Element,
+        registry:typing.Optional[typing.Dict[str,"MxItem"]]=None,
+        fileRoot:typing.Optional["DrawIoFile"]=None):
+        """
+        :param registry: if given, this item and all of its file children
+            are added to it by id as they are created
+        :param fileRoot: the file this belongs to
+            (if not given, it comes from fileParent)
+        """
         self._fileChildren:typing.List["MxItem"]=[]
         self._parent:typing.Optional["MxItem"]=None
         self._children:typing.List["MxItem"]=[]
-        self._root:"MxItem"=self
-        self._fileRoot:typing.Optional["MxItem"]=None
+        self._root:typing.Optional["MxItem"]=None
+        if fileRoot is None and fileParent is not None:
+            fileRoot=fileParent._fileRoot # pylint: disable=protected-access
+        self._fileRoot:typing.Optional["DrawIoFile"]=fileRoot
         self.fileParent:typing.Optional["MxItem"]=fileParent # the parent in the xml hierarchy # noqa: E501 # pylint: disable=line-too-long
-        self._xmlTag:lxml.etree.Etree=xmlTag
+        self._xmlTag:etree.Element=xmlTag
+        self._tag:str=''
+        self._id:typing.Optional[str]=None
+        self._parentId:typing.Optional[str]=None
+        self._value:typing.Optional[str]=None
+        self._assignXmlTag(xmlTag,registry) # builds the file children
 
     @property
     def mxType(self):
         """
         what type this item is
         """
-        return self._xmlTag.tag
+        return self._tag
 
     @property
     def mxId(self):
         """
         the unique id of this item
         """
-        return self._xmlTag.attrib.get('id')
+        return self._id
     @property
     def id(self):
         """
@@ -49,7 +206,7 @@ class MxItem:
         """
         a friendly, printable name for this node
         """
-        v=self._xmlTag.attrib.get('value')
+        v=self._value
         if v is None:
             return self.mxType
         return '%s "%s"'%(self.mxType,v)
@@ -59,10 +216,10 @@ class MxItem:
         """
         for instance the text of a textbox
         """
-        return self._xmlTag.attrib.get('value')
+        return self._value
 
     @property
-    def fileRoot(self):
+    def fileRoot(self)->typing.Optional["DrawIoFile"]:
         """
         the root in the xml hierarchy
         """
@@ -72,14 +229,14 @@ class MxItem:
         return self._fileRoot
 
     @property
-    def fileChildren(self)->typing.Iterable["MxItem"]:
+    def fileChildren(self)->typing.List["MxItem"]:
         """
         the children in the xml hierarchy
         """
         return self._fileChildren
 
     @property
-    def root(self)->"DrawIoFile":
+    def root(self)->"MxItem":
         """
         this is the root in terms of the logical diagram connections,
         as opposed to the root in the xml hierarchy (self.fileRoot),
@@ -87,9 +244,11 @@ class MxItem:
         """
         if self._root is None:
             p=self.parent
-            if p is not None:
+            if p is None:
+                self._root=self
+            else:
                 self._root=p.root
-        return self._root # type: ignore
+        return self._root
 
     @property
     def parent(self):
@@ -98,8 +257,8 @@ class MxItem:
         as opposed to the parent in the xml hierarchy (self.fileParent),
         which is totally different
         """
-        parentId=self._xmlTag.attrib.get('parent')
-        if self._parent is None or self._parent.id!=parentId:
+        parentId=self._parentId
+        if self._parent is None or self._parent._id!=parentId: # noqa: E501 # pylint: disable=line-too-long,protected-access
             if parentId is None:
                 self._parent=None
             else:
@@ -107,7 +266,7 @@ class MxItem:
         return self._parent
 
     @property
-    def children(self)->typing.Iterable["MxItem"]:
+    def children(self)->typing.List["MxItem"]:
         """
         this is the children in terms of the logical diagram connections,
         as opposed to the children in the xml hierarchy
@@ -122,16 +281,17 @@ class MxItem:
     def __getitem__(self,
         idx:typing.Union[int,slice]
         )->typing.Union["MxItem",typing.Iterable["MxItem"]]:
-        _=self.children # force load
-        return self._children[idx]
+        return self.children[idx]
 
     def walkFileTree(self)->typing.Generator["MxItem",None,None]:
         """
         walk the file tree(deapth-first) and yeild each mxItem
         """
-        yield self
-        for c in self.fileChildren:
-            yield from c.walkFileTree()
+        stack=[self]
+        while stack:
+            item=stack.pop()
+            yield item
+            stack.extend(reversed(item._fileChildren)) # noqa: E501 # pylint: disable=line-too-long,protected-access
 
     @property
     def xmlTag(self):
@@ -141,23 +301,52 @@ class MxItem:
         return self._xmlTag
     @xmlTag.setter
     def xmlTag(self,xmlTag):
+        self._assignXmlTag(xmlTag)
+
+    def _assignXmlTag(self,
+        xmlTag:etree.Element,
+        registry:typing.Optional[typing.Dict[str,"MxItem"]]=None):
+        """
+        assign the xml tag and build the file children from it
+
+        :param registry: if given, this item and all of its file children
+            are added to it by id as they are created
+        """
         self._xmlTag=xmlTag
-        self._fileChildren=[MxItem(self,childXml) for childXml in xmlTag]
+        # cache the attributes the properties use
+        attrs=xmlTag.attrib
+        self._tag=xmlTag.tag
+        self._id=attrs.get('id')
+        self._parentId=attrs.get('parent')
+        self._value=attrs.get('value')
+        if self._parentId is None:
+            self._root=self
+        if registry is not None and self._id is not None:
+            registry[self._id]=self
+        self._fileChildren=[MxItem(self,childXml,registry)
+            for childXml in xmlTag]
 
     def treeStr(self,indent='',ignore=None):
         """
         a printable tree outlining the logical structure
+
+        :param indent: prefix for the top line (children get more)
+        :param ignore: items already shown, which are not expanded again
         """
-        ret=[indent+self.name]
-        indent+='   '
         if ignore is None:
-            ignore=set([self])
-        elif self in ignore:
-            ret.append('...')
-        else:
-            for c in self.children:
-                ret.append(c.treeStr(indent,ignore))
-        return indent.join(ret)
+            ignore=set()
+        ret:typing.List[str]=[]
+        stack=[(self,indent)]
+        while stack:
+            item,itemIndent=stack.pop()
+            ret.append(itemIndent+item.name)
+            itemIndent+='   '
+            if item in ignore:
+                ret.append(itemIndent+'...')
+                continue
+            ignore.add(item)
+            stack.extend((c,itemIndent) for c in reversed(item.children))
+        return '\n'.join(ret)
 
 
 class DrawIoFile:
@@ -169,6 +358,7 @@ class DrawIoFile:
         self._itemTree:typing.Optional[MxItem]=None
         self._itemLookup:typing.Dict[str,MxItem]={} # handy table to look up items by id # noqa: E501 # pylint: disable=line-too-long
         self._etree:typing.Any=None
+        self._decodedCache:typing.Optional[str]=None # cleared whenever _etree changes # noqa: E501 # pylint: disable=line-too-long
         self.load(filename)
 
     def treeStr(self,indent='',ignore=None):
@@ -184,13 +374,22 @@ class DrawIoFile:
         (determines this by the file extension)
         """
         f=open(filename,'rb')
-        data=f.read().decode('utf-8')
+        data=f.read()
         f.close()
         self.assign(data,filename.rsplit('.',1)[-1]=='drawio')
 
     def _mxDecodeBlock(self,b:typing.Union[str,bytes])->str:
         """
         decode a single block of compressessed mxfile schmutz
+        """
+        return self._mxDecodeBlockBytes(b).decode('utf-8')
+
+    def _mxDecodeBlockBytes(self,
+        b:typing.Union[str,bytes]
+        )->typing.Union[bytes,bytearray]:
+        """
+        decode a single block of compressessed mxfile schmutz,
+        leaving the result as utf-8 bytes
 
         TODO: NOTE: IMPORTANT: KURT:
           read this!
@@ -201,29 +400,48 @@ class DrawIoFile:
         """
         if isinstance(b,str):
             b=b.encode('utf-8')
-        s=base64.b64decode(b)
-        b=zlib.decompress(s,wbits=-15)
-        s=unquote(b.decode('utf-8'))
-        return s
-
-    def _mxEncodeBlock(self,s:str)->str:
+        # decode and inflate a chunk at a time
+        b=b.translate(None,b' \t\r\n')
+        decompressor=zlib.decompressobj(wbits=-15)
+        # preallocate from a guess, growing if needed and trimming after
+        inflated=bytearray(min(len(b)*3//4*INFLATE_SIZE_ESTIMATE,
+            INFLATE_PREALLOCATE_LIMIT))
+        pos=0
+        for i in range(0,len(b),DECODE_CHUNK_SIZE):
+            data=base64.b64decode(b[i:i+DECODE_CHUNK_SIZE])
+            while data:
+                piece=decompressor.decompress(data,DECODE_CHUNK_SIZE)
+                inflated[pos:pos+len(piece)]=piece
+                pos+=len(piece)
+                data=decompressor.unconsumed_tail
+        piece=decompressor.flush()
+        if not decompressor.eof:
+            raise zlib.error('incomplete or truncated stream')
+        inflated[pos:pos+len(piece)]=piece
+        pos+=len(piece)
+        del inflated[pos:]
+        return _unquoteBytes(inflated)
+
+    def _mxEncodeBlock(self,s:typing.Union[str,bytes])->str:
         """
         encode a single block of compressessed mxfile
         """
-        b=quote(s)
-        b=zlib.compress(b,wbits=-15)
-        s=base64.b64encode(b)
-        return s
+        if isinstance(s,str):
+            s=s.encode('utf-8')
+        # same safe characters as javascript encodeURIComponent
+        b=quote_from_bytes(s,safe="!*'()").encode('ascii')
+        compressor=zlib.compressobj(wbits=-15)
+        b=compressor.compress(b)+compressor.flush()
+        return base64.b64encode(b).decode('ascii')
 
     @property
     def decoded(self)->str:
         """
         get the current file as a decoded string
         """
-        return lxml.etree\
-            .tostring(self._etree,pretty_print=True)\
-            .decode('utf-8')\
-            .strip()
+        if self._decodedCache is None:
+            self._decodedCache=_xmlToString(self._etree).strip()
+        return self._decodedCache
 
     @property
     def encoded(self)->str:
@@ -238,33 +456,50 @@ class DrawIoFile:
         """
         return self._itemLookup.get(mxId)
 
-    def assign(self,s:str,encoded=True,keepMxfileTag:bool=True):
+    def assign(self,
+        s:typing.Union[str,bytes],
+        encoded=True,
+        keepMxfileTag:bool=True):
         """
         assign this object to some xml
+
+        (bytes are preferred, since that is what the parser wants)
         """
+        self._decodedCache=None
+        if isinstance(s,str):
+            s=s.encode('utf-8')
         if encoded:
-            name='diagram'#'mxfile'
-            decoded:typing.List[str]=[]
-            for mx in s.split('<'+name):
-                if not decoded:
-                    # first time around is stuff before the mx tag
-                    decoded.append(mx)
-                    if keepMxfileTag:
-                        decoded.append('<'+name)
-                else:
-                    mxs=mx.split('>',1)
-                    if keepMxfileTag:
-                        decoded.append(mxs[0])
-                        decoded.append('>')
-                    mxs=mxs[1].split('</'+name+'>',1)
-                    decoded.append(self._mxDecodeBlock(mxs[0]))
-                    if keepMxfileTag:
-                        decoded.append('</'+name+'>')
-                    decoded.append(mxs[1])
-            s=''.join(decoded)
-        self._etree=lxml.etree.fromstring(s)
-        self._itemTree=MxItem(None,self._etree[0][0][0])
-        self._itemTree._fileRoot=self # pylint: disable=protected-access
+            # inflate each <diagram> payload into the parsed tree
+            context,diagrams=_iterparseDiagrams(s)
+            pages=[elem for elem in diagrams
+                if elem.text and elem.text.strip()]
+            payloads=[elem.text for elem in pages]
+            workers=min(len(pages),os.cpu_count() or 1)
+            if workers>1:
+                # inflate and compiled unquote release the gil
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    blocks=list(executor.map(
+                        self._mxDecodeBlockBytes,payloads))
+            else:
+                blocks=[self._mxDecodeBlockBytes(p) for p in payloads]
+            del payloads
+            for elem,block in zip(pages,blocks):
+                elem.text=None # release the encoded payload
+                elem.append(_xmlFromBytes(block))
+            self._etree=context.root
+            if not keepMxfileTag:
+                # replace each <diagram> with the model it holds
+                for i,elem in enumerate(self._etree):
+                    if elem.tag=='diagram' and len(elem):
+                        self._etree[i]=elem[0]
+        else:
+            self._etree=_xmlFromBytes(s)
+        # normally mxfile/diagram/mxGraphModel/root
+        xmlRoot=self._etree.find('.//root')
+        if xmlRoot is None:
+            raise ValueError('no <root> element found in the diagram xml')
+        self._itemLookup={}
+        self._itemTree=MxItem(None,xmlRoot,self._itemLookup,self)
         self._relinkAll()
 
     def _relinkAll(self):
@@ -272,13 +507,33 @@ class DrawIoFile:
         since each of the mx items specify only the parent, we need to
         fly through everything and link children to their parents
         """
-        self._itemLookup={}
-        for item in self._itemTree.walkFileTree():
-            self._itemLookup[item.id]=item
-        # now that everything is added, we can link it up
-        for item in self._itemLookup.values():
-            if item.parent is not None:
-                item.parent._children.append(item) # noqa: E501 # pylint: disable=line-too-long,protected-access
+        # group items by parent id, then give each parent its children
+        lookup=self._itemLookup
+        lookupGet=lookup.get
+        groups:typing.Dict[typing.Optional[str],typing.List[MxItem]]
+        groups=defaultdict(list)
+        for item in lookup.values():
+            groups[item._parentId].append(item) # noqa: E501 # pylint: disable=line-too-long,protected-access
+        for parentId,children in groups.items():
+            parent=lookupGet(parentId) if parentId else None
+            if parent is not None:
+                parent._children=children # pylint: disable=protected-access
+            for child in children:
+                child._parent=parent # pylint: disable=protected-access
+        # hand each logical root down to its descendants
+        stack=[item for item in lookup.values()
+            if item._parent is None] # pylint: disable=protected-access
+        for item in stack:
+            item._root=item # pylint: disable=protected-access
+        while stack:
+            item=stack.pop()
+            for child in item._children: # pylint: disable=protected-access
+                child._root=item._root # pylint: disable=protected-access
+                stack.append(child)
+        # items in a parent cycle are their own root
+        for item in lookup.values():
+            if item._root is None: # pylint: disable=protected-access
+                item._root=item # pylint: disable=protected-access
 
     def __str__(self)->str:
         """